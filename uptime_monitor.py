@@ -1,55 +1,400 @@
+import atexit
+import csv
+import gzip
+import hashlib
 import os
 import time
 import threading
 import ipaddress
 import platform
+import queue
+import select
+import shutil
+import socket
+import struct
 import subprocess
 from concurrent.futures import ThreadPoolExecutor
 
-from flask import Flask, jsonify, Response
+import brotli
+import orjson
+from flask import Flask, Response, request
 
 # === Konfiguration ===
 NETWORK_CIDR = os.getenv("NETWORK_CIDR", "192.168.178.0/24")
 SCAN_INTERVAL_SECONDS = 30
+# Kompletter Sweep über NETWORK_CIDR (neue Geräte finden); dazwischen
+# werden nur bekannte bzw. aktuell geführte Geräte gepingt
+FULL_SWEEP_INTERVAL_SECONDS = 300
 MAX_WORKERS = 64
 OFFLINE_FORGET_SECONDS = 300
 KNOWN_HOSTS_FILE = os.getenv("KNOWN_HOSTS_FILE", "known_hosts.txt")
 NEW_DEVICE_WINDOW_MINUTES = 5
 NEW_DEVICE_WINDOW_SECONDS = NEW_DEVICE_WINDOW_MINUTES * 60
-
-# devices: ip -> dict(...)
-#   ip, hostname, required, vip, from_known_hosts,
-#   first_seen, last_seen, online, created_at,
-#   seen_before_baseline (optional)
+# Jeder Stream-Client belegt dauerhaft einen Server-Thread (gunicorn:
+# --threads 8). Höchstens 4 Streams -> mindestens 4 Threads bleiben für
+# "/" und /api/devices frei; weitere Clients bekommen 503 und pollen.
+MAX_STREAM_CLIENTS = 4
+# Kurz genug, damit geschlossene Tabs ihren Platz schnell wieder freigeben
+STREAM_KEEPALIVE_SECONDS = 5
+
+# Zeitstempel der Geräte: time.monotonic_ns() (int, unabhängig von Uhr-Sprüngen)
+NS_PER_SECOND = 1_000_000_000
+OFFLINE_FORGET_NS = OFFLINE_FORGET_SECONDS * NS_PER_SECOND
+NEW_DEVICE_WINDOW_NS = NEW_DEVICE_WINDOW_SECONDS * NS_PER_SECOND
+
+
+class Device:
+    """Zustand eines Geräts. __slots__ statt dict: kein dict pro Eintrag."""
+
+    __slots__ = (
+        "ip", "ip_int", "hostname", "required", "vip", "from_known_hosts",
+        "first_seen", "last_seen", "online", "created_at",
+        "seen_before_baseline",
+    )
+
+    def __init__(self, ip, hostname=None, required=False, vip=False,
+                 from_known_hosts=False, first_seen=None, last_seen=None,
+                 online=False, created_at=None):
+        self.ip = ip
+        # Sortierschlüssel, einmal beim Anlegen berechnet
+        self.ip_int = int(ipaddress.IPv4Address(ip))
+        self.hostname = hostname
+        self.required = required
+        self.vip = vip
+        self.from_known_hosts = from_known_hosts
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.online = online
+        self.created_at = created_at
+        # wird bei der Baseline gesetzt
+        self.seen_before_baseline = False
+
+
+# devices: ip -> Device
 devices = {}
 devices_lock = threading.Lock()
 # Wird nach dem ersten vollständigen Scan auf True gesetzt
 baseline_done = False
+# Wird nach jedem Scan hochgezählt; Schlüssel für devices_cache
+state_version = 0
+# (state_version, etag, json_bytes, {encoding: bytes}) der letzten /api/devices-Antwort
+devices_cache = None
+# Unterscheidet ETags verschiedener Prozessläufe (state_version startet bei 0)
+BOOT_ID = format(time.time_ns(), "x")
+# /api/stream: eine Queue (maxsize=1, nur neuester Stand) pro Client
+stream_subscribers = set()
+stream_lock = threading.Lock()
 
 app = Flask(__name__)
 
 
 # -------- Ping & Known Hosts --------
 
-def ping_ip(ip: str, timeout_ms: int = 1000) -> bool:
-    system = platform.system().lower()
-    try:
-        if system == "windows":
-            cmd = ["ping", "-n", "1", "-w", str(timeout_ms), ip]
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+ICMP_PAYLOAD = b"netmonitor-kiosk"
+SWEEP_RCVBUF_BYTES = 1024 * 1024
+
+
+IS_WINDOWS = platform.system().lower() == "windows"
+# Einmal öffnen statt bei jedem ping-Aufruf
+_DEVNULL_FD = os.open(os.devnull, os.O_WRONLY)
+FPING = shutil.which("fping")
+# timeout_ms -> ping-Argumente ohne IP
+_ping_prefixes = {}
+
+
+def _ping_prefix(timeout_ms: int):
+    prefix = _ping_prefixes.get(timeout_ms)
+    if prefix is None:
+        if IS_WINDOWS:
+            prefix = ["ping", "-n", "1", "-w", str(timeout_ms)]
         else:
             timeout_s = max(1, int(timeout_ms / 1000))
-            cmd = ["ping", "-c", "1", "-W", str(timeout_s), ip]
+            prefix = ["ping", "-c", "1", "-W", str(timeout_s)]
+        _ping_prefixes[timeout_ms] = prefix
+    return prefix
 
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
+
+def _ping_subprocess(ip: str, timeout_ms: int = 1000) -> bool:
+    """Fallback: ping-Binary aufrufen (keine ICMP-Sockets erlaubt)."""
+    try:
+        # Python-fds sind nicht vererbbar (PEP 446) -> close_fds=False reicht
+        proc = subprocess.Popen(
+            _ping_prefix(timeout_ms) + [ip],
+            stdout=_DEVNULL_FD,
+            stderr=_DEVNULL_FD,
+            close_fds=False,
         )
-        return result.returncode == 0
+        return proc.wait() == 0
     except Exception:
         return False
 
 
+def _ping_fping(ips, timeout_ms: int = 1000):
+    """
+    Fallback: alle IPs mit einem einzigen fping-Aufruf prüfen.
+    Liefert die erreichbaren IPs oder None, wenn fping selbst fehlschlägt.
+    """
+    try:
+        result = subprocess.run(
+            [FPING, "-a", "-q", "-r0", "-t", str(timeout_ms), *ips],
+            stdout=subprocess.PIPE,
+            stderr=_DEVNULL_FD,
+        )
+    except OSError:
+        return None
+    # 0: alle erreichbar, 1: nicht alle, 2: Name nicht auflösbar; >= 3 Fehler
+    if result.returncode >= 3:
+        return None
+    return set(result.stdout.decode("ascii", "replace").split())
+
+
+def _fold_checksum(total: int) -> int:
+    """16-Bit Einerkomplement-Prüfsumme (RFC 1071) aus der Wortsumme."""
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _word_sum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    return sum(struct.unpack(f"!{len(data) // 2}H", data))
+
+
+_ICMP_HEADER = struct.Struct("!BBHHH")
+# Payload ist konstant -> ihren Anteil an der Prüfsumme nur einmal berechnen
+_PAYLOAD_WORD_SUM = _word_sum(ICMP_PAYLOAD)
+
+
+def build_echo_request(ident: int, seq: int) -> bytes:
+    checksum = _fold_checksum((ICMP_ECHO_REQUEST << 8) + ident + seq + _PAYLOAD_WORD_SUM)
+    return _ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, ident, seq) + ICMP_PAYLOAD
+
+
+class IcmpPinger:
+    """
+    ICMP Echo direkt über Sockets statt ein ping-Prozess pro Host.
+
+    Reihenfolge:
+      - SOCK_DGRAM/IPPROTO_ICMP (unprivilegiert, net.ipv4.ping_group_range)
+      - SOCK_RAW (root bzw. CAP_NET_RAW, z.B. im Docker-Container)
+      - Windows: IcmpSendEcho aus Iphlpapi.dll
+      - sonst: ping-Binary
+    Mit Socket werden alle Hosts eines Scans per sweep() über einen Socket
+    gepingt; ping() für einzelne Hosts gibt es nur für die Fallbacks.
+    """
+
+    def __init__(self):
+        self._ident_lock = threading.Lock()
+        self._next_ident = os.getpid() & 0xFFFF
+        self._iphlpapi = None
+        self.sock_type = None
+        # Sweep-Socket bleibt über alle Scans offen (nur vom Scan-Thread benutzt)
+        self._sweep_sock = None
+        self._sweep_poller = None
+        self._sweep_ident = 0
+        self._sweep_seq = 0
+        self._sweep_buf = bytearray(1024)
+
+        if IS_WINDOWS:
+            self._iphlpapi = self._load_iphlpapi()
+        else:
+            self.sock_type = self._probe_sock_type()
+
+        if self.sock_type is None and self._iphlpapi is None:
+            print("WARN: no ICMP socket available; falling back to ping binary")
+
+    @staticmethod
+    def _probe_sock_type():
+        for sock_type in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+            try:
+                socket.socket(socket.AF_INET, sock_type, socket.IPPROTO_ICMP).close()
+                return sock_type
+            except OSError:
+                continue
+        return None
+
+    @staticmethod
+    def _load_iphlpapi():
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            lib = ctypes.WinDLL("Iphlpapi.dll")
+            lib.IcmpCreateFile.restype = wintypes.HANDLE
+            lib.IcmpSendEcho.argtypes = [
+                wintypes.HANDLE, wintypes.ULONG, ctypes.c_void_p, wintypes.WORD,
+                ctypes.c_void_p, ctypes.c_void_p, wintypes.DWORD, wintypes.DWORD,
+            ]
+            lib.IcmpSendEcho.restype = wintypes.DWORD
+            lib.IcmpCloseHandle.argtypes = [wintypes.HANDLE]
+            return lib
+        except Exception:
+            return None
+
+    @property
+    def can_sweep(self) -> bool:
+        return self.sock_type is not None
+
+    @property
+    def has_icmp_api(self) -> bool:
+        """Windows: IcmpSendEcho verfügbar (hat Vorrang vor fping)."""
+        return self._iphlpapi is not None
+
+    def _new_socket(self):
+        return socket.socket(socket.AF_INET, self.sock_type, socket.IPPROTO_ICMP)
+
+    def _alloc_ident(self) -> int:
+        with self._ident_lock:
+            ident = self._next_ident
+            self._next_ident = (self._next_ident + 1) & 0xFFFF
+        return ident
+
+    def _parse_reply(self, buf, nbytes: int, ident: int):
+        """Liefert die Sequenznummer eines passenden Echo Reply, sonst None."""
+        offset = 0
+        if self.sock_type == socket.SOCK_RAW:
+            # Raw-Sockets liefern den IP-Header mit
+            offset = (buf[0] & 0x0F) * 4
+        if nbytes - offset < 8:
+            return None
+
+        icmp_type, _, _, reply_ident, reply_seq = _ICMP_HEADER.unpack_from(buf, offset)
+        if icmp_type != ICMP_ECHO_REPLY:
+            return None
+        # Bei SOCK_DGRAM setzt der Kernel die ID selbst (und filtert)
+        if self.sock_type == socket.SOCK_RAW and reply_ident != ident:
+            return None
+        return reply_seq
+
+    def ping(self, ip: str, timeout_ms: int = 1000) -> bool:
+        """Einzelner Host, nur für den Fallback ohne Sweep (siehe ping_hosts)."""
+        if self._iphlpapi is not None:
+            return self._ping_windows(ip, timeout_ms)
+        return _ping_subprocess(ip, timeout_ms)
+
+    def _sweep_socket(self):
+        if self._sweep_sock is None:
+            self._sweep_sock = self._new_socket()
+            # Platz für die Antworten eines kompletten Sweeps
+            self._sweep_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SWEEP_RCVBUF_BYTES)
+            # Einmal für POLLIN registrieren statt bei jedem Warten ein
+            # neues fd-Set für select() zu bauen
+            self._sweep_poller = select.poll()
+            self._sweep_poller.register(self._sweep_sock, select.POLLIN)
+            self._sweep_ident = self._alloc_ident()
+        else:
+            # Verspätete Antworten aus dem letzten Scan verwerfen
+            self._sweep_sock.setblocking(False)
+            try:
+                while True:
+                    self._sweep_sock.recv(1024)
+            except OSError:
+                pass
+            finally:
+                self._sweep_sock.setblocking(True)
+        return self._sweep_sock
+
+    def sweep(self, ips, timeout_ms: int = 1000) -> set:
+        """
+        Alle Echo Requests über einen Socket rausschicken und danach
+        gemeinsam auf die Antworten warten: ein Timeout pro Scan statt
+        pro Host, keine Worker-Threads. Liefert die erreichbaren IPs.
+
+        Der Socket wird einmal geöffnet und für alle weiteren Scans
+        wiederverwendet; die Sequenznummern laufen über die Scans weiter,
+        damit späte Antworten nicht dem falschen Scan zugeordnet werden.
+        """
+        reachable = set()
+        # ip -> erwartete Sequenznummer
+        pending = {}
+
+        try:
+            sock = self._sweep_socket()
+            poller = self._sweep_poller
+            ident = self._sweep_ident
+            buf = self._sweep_buf
+            recv_into = sock.recvfrom_into
+            parse = self._parse_reply
+            for ip in ips:
+                self._sweep_seq = (self._sweep_seq + 1) & 0xFFFF
+                seq = self._sweep_seq
+                try:
+                    sock.sendto(build_echo_request(ident, seq), (ip, 0))
+                except OSError:
+                    # z.B. Netz nicht erreichbar -> gilt als offline
+                    continue
+                pending[ip] = seq
+
+            deadline = time.monotonic() + timeout_ms / 1000
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if not poller.poll(remaining * 1000):
+                    break
+
+                # Alles abholen, was schon in der Queue liegt, bevor wieder
+                # in select() gewartet wird
+                while pending:
+                    try:
+                        nbytes, addr = recv_into(buf, 0, socket.MSG_DONTWAIT)
+                    except BlockingIOError:
+                        break
+                    except OSError:
+                        continue
+                    ip = addr[0]
+                    seq = pending.get(ip)
+                    if seq is not None and parse(buf, nbytes, ident) == seq:
+                        reachable.add(ip)
+                        del pending[ip]
+        except OSError as e:
+            # Socket kaputt -> beim nächsten Scan neu öffnen
+            print(f"WARN: ICMP sweep failed: {e}")
+            if self._sweep_sock is not None:
+                self._sweep_sock.close()
+                self._sweep_sock = None
+                self._sweep_poller = None
+
+        return reachable
+
+    def _ping_windows(self, ip: str, timeout_ms: int) -> bool:
+        import ctypes
+
+        lib = self._iphlpapi
+        # ICMP_ECHO_REPLY (28 Bytes auf 32 Bit, 40 Bytes auf x64) + Payload
+        # + 8 Bytes ICMP-Fehlerreserve; 64 deckt beide Varianten ab
+        reply_size = 64 + len(ICMP_PAYLOAD) + 8
+        reply = ctypes.create_string_buffer(reply_size)
+        try:
+            dest = ctypes.c_ulong.from_buffer_copy(socket.inet_aton(ip)).value
+        except OSError:
+            return False
+
+        handle = lib.IcmpCreateFile()
+        try:
+            count = lib.IcmpSendEcho(
+                handle, dest, ICMP_PAYLOAD, len(ICMP_PAYLOAD),
+                None, reply, reply_size, timeout_ms,
+            )
+            # ICMP_ECHO_REPLY.Status (Offset 4) == IP_SUCCESS
+            return count > 0 and struct.unpack_from("<I", reply.raw, 4)[0] == 0
+        finally:
+            lib.IcmpCloseHandle(handle)
+
+
+pinger = IcmpPinger()
+# Für den Fallback ohne ICMP-Sockets; einmal anlegen statt pro Scan.
+# Threads entstehen erst bei Bedarf.
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="scan")
+atexit.register(executor.shutdown, wait=False)
+
+
+TRUE_VALUES = frozenset(("true", "1", "yes", "ja"))
+
+
 def load_known_hosts(path: str):
     """
     Format:
@@ -58,27 +403,27 @@ def load_known_hosts(path: str):
     """
     info = {}
     try:
-        with open(path, encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                parts = [p.strip() for p in line.split(",")]
+        with open(path, encoding="utf-8", newline="") as f:
+            # Kommentare vorher raus, damit z.B. ein Anführungszeichen darin
+            # den csv-Parser nicht über die nächsten Zeilen laufen lässt
+            lines = (line for line in f if not line.lstrip().startswith("#"))
+            for parts in csv.reader(lines, skipinitialspace=True):
                 if len(parts) < 3:
                     continue
 
-                ip = parts[0]
-                hostname = parts[1]
-                req_str = parts[2].lower()
-                required = req_str in ("true", "1", "yes", "ja")
-
-                vip = False
-                if len(parts) >= 4:
-                    vip_str = parts[3].lower()
-                    vip = vip_str in ("true", "1", "yes", "ja")
+                ip = parts[0].strip()
+                if not ip:
+                    continue
+                try:
+                    ip = str(ipaddress.IPv4Address(ip))
+                except ValueError:
+                    print(f"WARN: {path}: invalid IP {ip!r}; line skipped")
+                    continue
+                required = parts[2].strip().lower() in TRUE_VALUES
+                vip = len(parts) >= 4 and parts[3].strip().lower() in TRUE_VALUES
 
                 info[ip] = {
-                    "hostname": hostname,
+                    "hostname": parts[1].strip(),
                     "required": required,
                     "vip": vip,
                 }
@@ -87,111 +432,286 @@ def load_known_hosts(path: str):
     return info
 
 
-known_hosts_info = load_known_hosts(KNOWN_HOSTS_FILE)
+def known_hosts_mtime(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def build_host_list(info: dict):
+    """Netzbereich + bekannte Hosts, nach IP sortiert."""
+    host_set = {str(h) for h in network.hosts()}
+    host_set.update(info.keys())
+    return sorted(host_set, key=lambda ip: int(ipaddress.ip_address(ip)))
+
+
+def apply_known_hosts(info: dict, previous: dict, now: int):
+    """
+    known_hosts in devices übernehmen. Aufrufer hält devices_lock.
+    Hosts, die aus der Datei verschwunden sind, werden zu normalen
+    dynamischen Geräten (und irgendwann vom Aufräumen entfernt).
+    """
+    for ip, host in info.items():
+        entry = devices.get(ip)
+        if entry is None:
+            entry = devices[ip] = Device(ip, created_at=now)
+            # bekannte Hosts sind nie "neu"
+            entry.seen_before_baseline = True
+        entry.hostname = host["hostname"]
+        entry.required = host["required"]
+        entry.vip = host["vip"]
+        entry.from_known_hosts = True
+
+    for ip in previous.keys() - info.keys():
+        entry = devices.get(ip)
+        if entry is not None:
+            entry.hostname = None
+            entry.required = False
+            entry.vip = False
+            entry.from_known_hosts = False
+
+
+def reload_known_hosts_if_changed():
+    """
+    known_hosts.txt neu einlesen, wenn sich die mtime geändert hat.
+    Schlägt das fehl, bleibt der alte Stand aktiv und der Scanner läuft
+    weiter; beim nächsten Scan wird es erneut versucht.
+    """
+    global known_hosts_info, known_hosts_stamp, hosts
+    stamp = known_hosts_mtime(KNOWN_HOSTS_FILE)
+    if stamp == known_hosts_stamp:
+        return
+
+    try:
+        # Alles vorbereiten, bevor devices angefasst wird
+        info = load_known_hosts(KNOWN_HOSTS_FILE)
+        new_hosts = build_host_list(info)
+        with devices_lock:
+            apply_known_hosts(info, known_hosts_info, time.monotonic_ns())
+            known_hosts_info = info
+            hosts = new_hosts
+    except Exception as e:
+        print(f"WARN: reloading {KNOWN_HOSTS_FILE} failed, keeping previous hosts: {e!r}")
+        return
+
+    known_hosts_stamp = stamp
+    print(f"INFO: reloaded {KNOWN_HOSTS_FILE} ({len(info)} hosts)")
+
 
 # Netzbereich + bekannte Hosts scannen
 network = ipaddress.ip_network(NETWORK_CIDR, strict=False)
-hosts = [str(h) for h in network.hosts()]
-
-host_set = set(hosts)
-host_set.update(known_hosts_info.keys())
-hosts = sorted(host_set, key=lambda ip: int(ipaddress.ip_address(ip)))
+known_hosts_stamp = known_hosts_mtime(KNOWN_HOSTS_FILE)
+known_hosts_info = load_known_hosts(KNOWN_HOSTS_FILE)
+hosts = build_host_list(known_hosts_info)
 
 # devices initial mit known_hosts füllen
-now_init = time.time()
 with devices_lock:
-    for ip, info in known_hosts_info.items():
-        devices[ip] = {
-            "ip": ip,
-            "hostname": info["hostname"],
-            "required": info["required"],
-            "vip": info.get("vip", False),
-            "from_known_hosts": True,
-            "first_seen": None,
-            "last_seen": None,
-            "online": False,
-            "created_at": now_init,
-            # wird später bei der Baseline gesetzt
-        }
+    apply_known_hosts(known_hosts_info, {}, time.monotonic_ns())
 
 
 # -------- Scan-Logik --------
 
+def update_device(ip: str, ok: bool, now: int):
+    """Ein Ping-Ergebnis eintragen. Aufrufer hält devices_lock."""
+    entry = devices.get(ip)
+
+    if ok:
+        # Host antwortet
+        if entry is None:
+            # neues dynamisches Gerät
+            # seen_before_baseline bleibt hier bewusst False
+            devices[ip] = Device(
+                ip,
+                first_seen=now,
+                last_seen=now,
+                online=True,
+                created_at=now,
+            )
+        else:
+            if entry.first_seen is None:
+                entry.first_seen = now
+            entry.last_seen = now
+            entry.online = True
+    else:
+        # keine Antwort
+        if entry is None:
+            # offline & unbekannt -> ignorieren
+            return
+        else:
+            entry.online = False
+
+
 def scan_host(ip: str):
-    ok = ping_ip(ip, timeout_ms=1000)
-    now = time.time()
+    return ip, pinger.ping(ip, timeout_ms=1000)
+
+
+# Netlink (linux/netlink.h, linux/rtnetlink.h, linux/neighbour.h)
+NETLINK_ROUTE = 0
+RTM_NEWNEIGH = 28
+RTM_GETNEIGH = 30
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NDA_DST = 1
+NUD_INCOMPLETE = 0x01
+NUD_REACHABLE = 0x02
+NUD_DELAY = 0x08
+NUD_FAILED = 0x20
+# Vom Kernel gerade bestätigt -> gilt ohne Ping als online. STALE-Einträge
+# werden weiter gepingt; der Ping stößt dabei die ARP-Prüfung neu an.
+NUD_PRESENT = NUD_REACHABLE | NUD_DELAY
+NUD_ABSENT = NUD_INCOMPLETE | NUD_FAILED
+
+_NLMSG_HEADER = struct.Struct("=IHHII")   # len, type, flags, seq, pid
+_NDMSG = struct.Struct("=BBHiHBB")        # family, pad, pad, ifindex, state, flags, type
+_RTATTR = struct.Struct("=HH")            # len, type
+
+
+def read_neighbours():
+    """
+    ip -> NUD-Zustand aus der Nachbartabelle des Kernels (ein
+    RTM_GETNEIGH-Dump über Netlink, entspricht "ip -4 neigh").
+    Leer, wenn Netlink nicht verfügbar ist (z.B. Windows).
+    """
+    states = {}
+    if not hasattr(socket, "AF_NETLINK"):
+        return states
+
+    request_msg = _NLMSG_HEADER.pack(
+        _NLMSG_HEADER.size + _NDMSG.size, RTM_GETNEIGH, NLM_F_REQUEST | NLM_F_DUMP, 1, 0,
+    ) + _NDMSG.pack(socket.AF_INET, 0, 0, 0, 0, 0, 0)
+
+    try:
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE) as sock:
+            sock.settimeout(1)
+            sock.sendto(request_msg, (0, 0))
+            while True:
+                data = sock.recv(65536)
+                offset = 0
+                while offset + _NLMSG_HEADER.size <= len(data):
+                    msg_len, msg_type, _, _, _ = _NLMSG_HEADER.unpack_from(data, offset)
+                    if msg_type in (NLMSG_DONE, NLMSG_ERROR) or msg_len < _NLMSG_HEADER.size:
+                        return states
+                    if msg_type == RTM_NEWNEIGH:
+                        _parse_neighbour(data, offset, msg_len, states)
+                    offset += (msg_len + 3) & ~3
+    except OSError:
+        pass
+    return states
+
+
+def _parse_neighbour(data: bytes, offset: int, msg_len: int, states: dict):
+    body = offset + _NLMSG_HEADER.size
+    family, _, _, _, state, _, _ = _NDMSG.unpack_from(data, body)
+    if family != socket.AF_INET:
+        return
+
+    end = offset + msg_len
+    pos = body + _NDMSG.size
+    while pos + _RTATTR.size <= end:
+        attr_len, attr_type = _RTATTR.unpack_from(data, pos)
+        if attr_len < _RTATTR.size:
+            return
+        if attr_type == NDA_DST and attr_len == _RTATTR.size + 4:
+            ip = socket.inet_ntoa(data[pos + _RTATTR.size:pos + attr_len])
+            states[ip] = state
+            return
+        pos += (attr_len + 3) & ~3
+
+
+def scan_targets(full_sweep: bool, neighbours: dict):
+    """Zu pingende IPs: alle geführten Geräte, beim Sweep zusätzlich das Netz."""
+    if full_sweep:
+        # Adressen, deren ARP-Auflösung der Kernel schon aufgegeben hat,
+        # müssen im Sweep nicht gepingt werden
+        with devices_lock:
+            return [
+                ip for ip in hosts
+                if ip in devices or not neighbours.get(ip, 0) & NUD_ABSENT
+            ]
     with devices_lock:
-        entry = devices.get(ip)
+        return [d.ip for d in sorted(devices.values(), key=lambda d: d.ip_int)]
 
-        if ok:
-            # Host antwortet
-            if entry is None:
-                # neues dynamisches Gerät
-                devices[ip] = {
-                    "ip": ip,
-                    "hostname": None,
-                    "required": False,
-                    "vip": False,
-                    "from_known_hosts": False,
-                    "first_seen": now,
-                    "last_seen": now,
-                    "online": True,
-                    "created_at": now,
-                    # seen_before_baseline wird hier bewusst NICHT gesetzt
-                }
-            else:
-                if entry.get("first_seen") is None:
-                    entry["first_seen"] = now
-                entry["last_seen"] = now
-                entry["online"] = True
-        else:
-            # keine Antwort
-            if entry is None:
-                # offline & unbekannt -> ignorieren
-                return
-            else:
-                entry["online"] = False
+
+def ping_hosts(ips) -> set:
+    """
+    Erreichbare IPs. Vorrang: ICMP-Sweep, dann fping (nur ohne
+    IcmpSendEcho), sonst einzeln über den Thread-Pool.
+    """
+    if pinger.can_sweep:
+        return pinger.sweep(ips, timeout_ms=1000)
+    if FPING and ips and not pinger.has_icmp_api:
+        # ein Prozess für alle Hosts statt einem ping-Prozess pro Host
+        reachable = _ping_fping(ips, timeout_ms=1000)
+        if reachable is not None:
+            return reachable
+    # Worker pingen nur; eingetragen wird gesammelt unter einem Lock
+    return {ip for ip, ok in executor.map(scan_host, ips) if ok}
+
+
+def apply_scan_results(ips, reachable: set):
+    """Ergebnisse eines kompletten Sweeps in einem Durchgang eintragen."""
+    now = time.monotonic_ns()
+    with devices_lock:
+        for ip in ips:
+            update_device(ip, ip in reachable, now)
 
 
 def scan_loop():
-    global baseline_done
+    global baseline_done, state_version
     first_iteration = True
+    last_full_sweep = None
 
     while True:
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            executor.map(scan_host, hosts)
+        reload_known_hosts_if_changed()
+
+        # Der erste Scan ist immer ein kompletter Sweep (Baseline)
+        full_sweep = (
+            last_full_sweep is None or
+            time.monotonic() - last_full_sweep >= FULL_SWEEP_INTERVAL_SECONDS
+        )
+        if full_sweep:
+            last_full_sweep = time.monotonic()
+        neighbours = read_neighbours()
+        targets = scan_targets(full_sweep, neighbours)
 
-        now = time.time()
+        # Was der Kernel gerade als erreichbar kennt, muss nicht gepingt werden
+        present = {ip for ip in targets if neighbours.get(ip, 0) & NUD_PRESENT}
+        reachable = ping_hosts([ip for ip in targets if ip not in present])
+        apply_scan_results(targets, reachable | present)
+
+        now = time.monotonic_ns()
         with devices_lock:
             # Beim allerersten kompletten Scan:
             # alle zu diesem Zeitpunkt bekannten Geräte als "Baseline" markieren.
             if first_iteration and not baseline_done:
                 for d in devices.values():
-                    d["seen_before_baseline"] = True
+                    d.seen_before_baseline = True
                 baseline_done = True
                 first_iteration = False
 
-            # Aufräumen: unbekannte, lange offline Geräte
-            to_delete = []
-            for ip, d in list(devices.items()):
-                if d.get("from_known_hosts") or d.get("required"):
-                    continue
-                if d.get("online"):
-                    continue
-                base = d.get("last_seen") or d.get("created_at") or now
-                if now - base > OFFLINE_FORGET_SECONDS:
-                    to_delete.append(ip)
+            # Aufräumen: unbekannte, lange offline Geräte.
+            # Erst die IPs sammeln (ohne Kopie von devices), dann löschen.
+            forget_before = now - OFFLINE_FORGET_NS
+            to_delete = [
+                ip for ip, d in devices.items()
+                if not (d.from_known_hosts or d.required or d.online)
+                and (d.last_seen or d.created_at or now) < forget_before
+            ]
             for ip in to_delete:
                 del devices[ip]
 
+            state_version += 1
+
+        publish_devices()
         time.sleep(SCAN_INTERVAL_SECONDS)
 
 
 # -------- Web-UI (800x240, 6 Kästen/Zeile) --------
 
-@app.route("/")
-def index():
-    html = """
+INDEX_HTML = """
 <!doctype html>
 <html lang="de">
 <head>
@@ -326,162 +846,313 @@ def index():
     return r + "s";
   }
 
-  async function loadDevices() {
-    try {
-      const res = await fetch("/api/devices");
-      const data = await res.json();
-
-      const container = document.getElementById("bubbles");
-      container.innerHTML = "";
-
-      document.getElementById("net").textContent = data.network;
-      document.getElementById("count").textContent = data.devices.length;
-      document.getElementById("ts").textContent = new Date().toLocaleTimeString();
-
-      data.devices.forEach(dev => {
-        const bubble = document.createElement("div");
-        const classes = ["bubble"];
-
-        // Farb-/Blink-Logik:
-        if (dev.online) {
-          if (dev.vip) {
-            classes.push("vip-online");
-            if (dev.is_new) {
-              classes.push("blink");  // neuer VIP -> blinkt
-            }
-          } else if (dev.is_new) {
-            classes.push("new-online", "blink");
-          } else {
-            classes.push("online");
-          }
-        } else {
-          if (dev.required) {
-            classes.push("offline-required", "blink");
-          }
-          // offline & nicht required / VIP offline werden gar nicht geliefert
-        }
+  function render(data) {
+    const container = document.getElementById("bubbles");
+    container.innerHTML = "";
 
-        bubble.className = classes.join(" ");
+    document.getElementById("net").textContent = data.network;
+    document.getElementById("count").textContent = data.devices.length;
+    document.getElementById("ts").textContent = new Date().toLocaleTimeString();
 
-        const hostname = document.createElement("div");
-        hostname.className = "hostname";
-        hostname.textContent = dev.hostname || dev.ip;
+    data.devices.forEach(dev => {
+      const bubble = document.createElement("div");
+      const classes = ["bubble"];
 
-        const ip = document.createElement("div");
-        ip.className = "ip";
-        if (dev.hostname) {
-          ip.textContent = dev.ip;
+      // Farb-/Blink-Logik:
+      if (dev.online) {
+        if (dev.vip) {
+          classes.push("vip-online");
+          if (dev.is_new) {
+            classes.push("blink");  // neuer VIP -> blinkt
+          }
+        } else if (dev.is_new) {
+          classes.push("new-online", "blink");
         } else {
-          ip.textContent = "";
+          classes.push("online");
         }
-
-        const status = document.createElement("div");
-        status.className = "status";
-        if (dev.online) {
-          status.textContent = "online seit " + formatAge(dev.age_seconds);
-        } else if (dev.last_seen_seconds_ago != null) {
-          status.textContent = "offline seit " + formatAge(dev.last_seen_seconds_ago);
-        } else {
-          status.textContent = "offline (noch nie erreicht)";
+      } else {
+        if (dev.required) {
+          classes.push("offline-required", "blink");
         }
+        // offline & nicht required / VIP offline werden gar nicht geliefert
+      }
+
+      bubble.className = classes.join(" ");
+
+      const hostname = document.createElement("div");
+      hostname.className = "hostname";
+      hostname.textContent = dev.hostname || dev.ip;
+
+      const ip = document.createElement("div");
+      ip.className = "ip";
+      if (dev.hostname) {
+        ip.textContent = dev.ip;
+      } else {
+        ip.textContent = "";
+      }
+
+      const status = document.createElement("div");
+      status.className = "status";
+      if (dev.online) {
+        status.textContent = "online seit " + formatAge(dev.age_seconds);
+      } else if (dev.last_seen_seconds_ago != null) {
+        status.textContent = "offline seit " + formatAge(dev.last_seen_seconds_ago);
+      } else {
+        status.textContent = "offline (noch nie erreicht)";
+      }
+
+      bubble.appendChild(hostname);
+      if (ip.textContent) bubble.appendChild(ip);
+      bubble.appendChild(status);
+
+      container.appendChild(bubble);
+    });
+  }
 
-        bubble.appendChild(hostname);
-        if (ip.textContent) bubble.appendChild(ip);
-        bubble.appendChild(status);
-
-        container.appendChild(bubble);
-      });
+  async function loadDevices() {
+    try {
+      const res = await fetch("/api/devices");
+      render(await res.json());
     } catch (e) {
       console.error("Fehler beim Laden der Geräte", e);
     }
   }
 
-  loadDevices();
-  setInterval(loadDevices, REFRESH_INTERVAL_MS);
+  let pollTimer = null;
+  function startPolling() {
+    if (pollTimer) return;
+    loadDevices();
+    pollTimer = setInterval(loadDevices, REFRESH_INTERVAL_MS);
+  }
+
+  // Server schickt nach jedem Scan den neuen Stand; Polling nur als Fallback
+  if (window.EventSource) {
+    const source = new EventSource("/api/stream");
+    source.onmessage = (e) => render(JSON.parse(e.data));
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) startPolling();
+    };
+  } else {
+    startPolling();
+  }
 </script>
 </body>
 </html>
 """
-    return Response(html, mimetype="text/html")
+# Die Seite ist konstant -> einmal kodieren, ETag aus dem Inhalt
+INDEX_BYTES = INDEX_HTML.encode("utf-8")
+INDEX_ETAG = hashlib.sha1(INDEX_BYTES).hexdigest()
+# Content-Encoding -> vorkomprimierte Bytes, in Reihenfolge der Präferenz
+INDEX_ENCODED = {
+    "br": brotli.compress(INDEX_BYTES, quality=11),
+    "gzip": gzip.compress(INDEX_BYTES, compresslevel=9),
+}
+
+
+def encoded_response(body: bytes, encoded: dict, mimetype: str, etag: str):
+    """
+    Response mit der ersten vorkomprimierten Variante aus encoded, die der
+    Client per Accept-Encoding akzeptiert; sonst unkomprimiert.
+    """
+    for encoding, data in encoded.items():
+        # Qualität statt "in": "br;q=0" heißt ausdrücklich abgelehnt
+        if request.accept_encodings[encoding] > 0:
+            response = Response(data, mimetype=mimetype)
+            response.content_encoding = encoding
+            # Jede Kodierung ist eine eigene Repräsentation -> eigener ETag
+            response.set_etag(f"{etag}-{encoding}")
+            break
+    else:
+        response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+@app.route("/")
+def index():
+    response = encoded_response(INDEX_BYTES, INDEX_ENCODED, "text/html", INDEX_ETAG)
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response.make_conditional(request)
 
 
 # -------- API (Sortierung + Filter + "neu" nach Baseline) --------
 
+def snapshot_devices():
+    """Die für die API nötigen Felder kopieren. Aufrufer hält devices_lock."""
+    return [
+        (d.ip, d.ip_int, d.hostname, d.required, d.vip, d.from_known_hosts,
+         d.online, d.first_seen, d.last_seen, d.seen_before_baseline)
+        for d in devices.values()
+    ]
+
+
+def is_new_device(online: bool, first_seen, seen_before_baseline: bool, window_start: int) -> bool:
+    """Nach der Baseline aufgetaucht, online und erst seit kurzem gesehen."""
+    return (
+        online and
+        not seen_before_baseline and
+        first_seen is not None and
+        first_seen >= window_start
+    )
+
+
+def build_devices_payload(snapshot, baseline: bool, now: int) -> dict:
+    """Antwort für /api/devices aus einem Snapshot (ohne Lock) bauen."""
+    window_start = now - NEW_DEVICE_WINDOW_NS
+    # (group, ip_int, eintrag) -> Sortierschlüssel landen nicht im JSON
+    keyed = []
+    for (ip, ip_int, hostname, required, vip, from_known,
+         online, first_seen, last_seen, seen_before_baseline) in snapshot:
+        # Filter:
+        if not online:
+            # VIP offline -> nicht anzeigen
+            if vip:
+                continue
+            # offline & nicht required -> nicht anzeigen
+            if not required:
+                continue
+            # offline & nicht aus known_hosts -> nicht anzeigen
+            if not from_known:
+                continue
+
+        age_ns = now - first_seen if first_seen is not None else None
+        last_seen_ago_ns = now - last_seen if last_seen is not None else None
+
+        # "neu" nur für Geräte, die NACH der Baseline hinzugekommen sind
+        if not baseline:
+            is_new = False
+        else:
+            is_new = is_new_device(online, first_seen, seen_before_baseline, window_start)
+
+        # Sortier-Gruppen:
+        # 0: known_hosts + required
+        # 1: VIP online
+        # 2: neue Geräte
+        # 3: Rest
+        if from_known and required:
+            group = 0
+        elif vip and online:
+            group = 1
+        elif is_new:
+            group = 2
+        else:
+            group = 3
+
+        keyed.append((group, ip_int, {
+            "ip": ip,
+            "hostname": hostname,
+            "required": required,
+            "vip": vip,
+            "online": online,
+            "age_seconds": age_ns / NS_PER_SECOND if age_ns is not None else None,
+            "last_seen_seconds_ago": (
+                last_seen_ago_ns / NS_PER_SECOND if last_seen_ago_ns is not None else None
+            ),
+            "is_new": is_new,
+        }))
+
+    keyed.sort(key=lambda entry: (entry[0], entry[1]))
+
+    return {
+        "network": NETWORK_CIDR,
+        "devices": [entry[2] for entry in keyed],
+    }
+
+
 @app.route("/api/devices")
 def api_devices():
-    now = time.time()
-    with devices_lock:
-        result = []
-        for ip, d in devices.items():
-            online = d.get("online", False)
-            required = d.get("required", False)
-            from_known = d.get("from_known_hosts", False)
-            vip = d.get("vip", False)
-
-            # Filter:
-            if not online:
-                # VIP offline -> nicht anzeigen
-                if vip:
-                    continue
-                # offline & nicht required -> nicht anzeigen
-                if not required:
-                    continue
-                # offline & nicht aus known_hosts -> nicht anzeigen
-                if not from_known:
-                    continue
+    _, etag, body, encoded = current_devices_cache()
 
-            first_seen = d.get("first_seen")
-            last_seen = d.get("last_seen")
-
-            age = now - first_seen if first_seen is not None else None
-            last_seen_ago = now - last_seen if last_seen is not None else None
-            seen_before_baseline = d.get("seen_before_baseline", False)
-
-            # "neu" nur für Geräte, die NACH der Baseline hinzugekommen sind
-            is_new = bool(
-                online and
-                first_seen is not None and
-                baseline_done and
-                not seen_before_baseline and
-                age is not None and
-                age <= NEW_DEVICE_WINDOW_SECONDS
-            )
+    response = encoded_response(body, encoded, "application/json", etag)
+    # Browser soll immer per If-None-Match nachfragen
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
-            # Sortier-Gruppen:
-            # 0: known_hosts + required
-            # 1: VIP online
-            # 2: neue Geräte
-            # 3: Rest
-            if from_known and required:
-                group = 0
-            elif vip and online:
-                group = 1
-            elif is_new:
-                group = 2
-            else:
-                group = 3
-
-            result.append({
-                "ip": ip,
-                "hostname": d.get("hostname"),
-                "required": required,
-                "vip": vip,
-                "online": online,
-                "age_seconds": age,
-                "last_seen_seconds_ago": last_seen_ago,
-                "is_new": is_new,
-                "group": group,
-            })
-
-        result.sort(key=lambda dev: (dev["group"], ipaddress.ip_address(dev["ip"])))
-
-    for dev in result:
-        dev.pop("group", None)
-
-    return jsonify({
-        "network": NETWORK_CIDR,
-        "devices": result,
-    })
+
+def current_devices_cache():
+    """
+    (state_version, etag, json_bytes, {encoding: bytes}) zum aktuellen Stand.
+    Der Inhalt ändert sich nur mit jedem Scan -> pro state_version einmal
+    bauen und komprimieren, danach die gecachten Bytes ausliefern.
+    Alter/"neu" gelten damit jeweils zum Zeitpunkt nach dem Scan.
+    """
+    global devices_cache
+    cache = devices_cache
+    if cache is None or cache[0] != state_version:
+        # Nur das Kopieren passiert unter dem Lock; Bauen, Sortieren und
+        # Serialisieren blockieren den Scanner nicht.
+        with devices_lock:
+            version = state_version
+            snapshot = snapshot_devices()
+            baseline = baseline_done
+        body = orjson.dumps(build_devices_payload(snapshot, baseline, time.monotonic_ns()))
+        cache = (version, f"{BOOT_ID}-v{version}", body, {"gzip": gzip.compress(body)})
+        devices_cache = cache
+    return cache
+
+
+def _offer(q: queue.Queue, body: bytes):
+    """Nur der neueste Stand zählt: alten Eintrag ggf. verwerfen."""
+    try:
+        q.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        q.put_nowait(body)
+    except queue.Full:
+        pass
+
+
+def publish_devices():
+    """Neuen Stand an alle /api/stream-Clients schicken (nach jedem Scan)."""
+    with stream_lock:
+        subscribers = list(stream_subscribers)
+    if not subscribers:
+        return
+    body = current_devices_cache()[2]
+    for q in subscribers:
+        _offer(q, body)
+
+
+@app.route("/api/stream")
+def api_stream():
+    """Server-Sent Events: gleicher Inhalt wie /api/devices, nach jedem Scan."""
+    q = queue.Queue(maxsize=1)
+    with stream_lock:
+        if len(stream_subscribers) >= MAX_STREAM_CLIENTS:
+            # EventSource schließt bei 503 -> Seite fällt auf Polling zurück
+            return Response("too many stream clients\n", status=503, mimetype="text/plain")
+        stream_subscribers.add(q)
+    # Direkt mit dem aktuellen Stand beginnen
+    _offer(q, current_devices_cache()[2])
+
+    def unsubscribe():
+        with stream_lock:
+            stream_subscribers.discard(q)
+
+    def events():
+        try:
+            while True:
+                try:
+                    body = q.get(timeout=STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Kommentarzeile hält die Verbindung offen und
+                    # bemerkt geschlossene Clients
+                    yield b": keepalive\n\n"
+                    continue
+                yield b"data: " + body + b"\n\n"
+        finally:
+            unsubscribe()
+
+    response = Response(events(), mimetype="text/event-stream")
+    # Auch wenn der Generator nie gestartet wurde, den Platz freigeben
+    response.call_on_close(unsubscribe)
+    response.cache_control.no_cache = True
+    # Proxies (nginx) sollen nicht puffern
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 
 def start_scanner():
@@ -0,0 +1,14 @@
+"""
+WSGI-Einstieg für gunicorn:
+
+    gunicorn -w 1 -k gthread --threads 8 -b 0.0.0.0:8000 wsgi:application
+
+Nur ein Worker: Geräteliste und Scanner leben im Prozess, mehrere Worker
+hätten jeweils einen eigenen Scanner und eigenen Zustand. Aus demselben
+Grund kein --preload (der Scanner-Thread überlebt den fork nicht).
+"""
+from uptime_monitor import app, start_scanner
+
+start_scanner()
+
+application = app